@@ -1,14 +1,25 @@
-import requests
+import asyncio
 import pytz
+import aiohttp
+from aiohttp import web
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, CallbackContext
 import pymongo
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorClient
+from cachetools import TTLCache
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 import os
+import re
+import time
+import queue
+import atexit
+import signal
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, date
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import firebase_admin
 from firebase_admin import credentials, messaging
 
@@ -17,25 +28,80 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 MONGO_URI = os.getenv('MONGO_URI')
 DB_NAME = os.getenv('DB_NAME', 'Cluster0')
-
-# MongoDB connection handling
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    client.admin.command('ping')  # Test connection
-    db = client[DB_NAME]
-    users_collection = db['users']
-    tasks_collection = db['tasks']
-    logs_collection = db['audit_logs']
-    logging.info(f"Successfully connected to MongoDB database: {DB_NAME}")
-except pymongo.errors.PyMongoError as e:
-    logging.critical(f"Failed to connect to MongoDB: {e}")
-    exit(1)
-
-# Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+PORT = int(os.getenv('PORT', 8080))
+FIREBASE_CREDENTIALS_PATH = os.getenv('FIREBASE_CREDENTIALS_PATH')
+FCM_MAX_RATE = int(os.getenv('FCM_MAX_RATE', 500))
+FCM_TIME_PERIOD = float(os.getenv('FCM_TIME_PERIOD', 1))
+
+# MongoDB handles; created inside the running event loop by init_db()
+client = None
+db = None
+users_collection = None
+tasks_collection = None
+logs_collection = None
+
+# Shared HTTP session for all outbound calls; created in main(), pooled and
+# keep-alive so concurrent requests overlap instead of blocking the loop
+http_session = None
+
+# Fire-and-forget user updates are queued here and flushed in bulk by
+# drain_writes(); writes whose result drives the reply stay synchronous
+write_queue: asyncio.Queue = asyncio.Queue()
+WRITE_BATCH_MAX = 500
+WRITE_BATCH_WINDOW = 0.01  # seconds to let a burst accumulate
+
+async def drain_writes(stop: asyncio.Event):
+    """Drain queued UpdateOne ops into batched bulk_write calls."""
+    while not (stop.is_set() and write_queue.empty()):
+        try:
+            first = await asyncio.wait_for(write_queue.get(), timeout=1.0)
+        except asyncio.TimeoutError:
+            continue
+        batch = [first]
+        await asyncio.sleep(WRITE_BATCH_WINDOW)
+        while not write_queue.empty() and len(batch) < WRITE_BATCH_MAX:
+            batch.append(write_queue.get_nowait())
+        try:
+            await users_collection.bulk_write(batch, ordered=False)
+        except Exception as e:
+            # The drainer runs under the main TaskGroup; letting anything
+            # escape here would cancel the group and stop the whole bot
+            logging.error(f"Batched write of {len(batch)} ops failed: {e}")
+
+async def init_db():
+    """Connect to MongoDB with the async driver. Must run inside the event loop."""
+    global client, db, users_collection, tasks_collection, logs_collection
+    try:
+        client = AsyncIOMotorClient(MONGO_URI, serverSelectionTimeoutMS=5000, maxPoolSize=100)
+        await client.admin.command('ping')  # Test connection
+        db = client[DB_NAME]
+        users_collection = db['users']
+        tasks_collection = db['tasks']
+        logs_collection = db['audit_logs']
+        # Indexes: point lookups on user_id, index-backed sort for the leaderboard,
+        # and last_claimed for the daily reminder queries
+        await users_collection.create_index([('user_id', ASCENDING)], unique=True)
+        await users_collection.create_index([('balance', DESCENDING)])
+        await users_collection.create_index([('last_claimed', ASCENDING)])
+        logging.info(f"Successfully connected to MongoDB database: {DB_NAME}")
+    except pymongo.errors.PyMongoError as e:
+        logging.critical(f"Failed to connect to MongoDB: {e}")
+        raise SystemExit(1)
+
+# Set up logging: handlers emit into an in-memory queue and a background
+# QueueListener thread does the actual stream I/O, keeping log calls in
+# request handlers off the syscall path. The QueueHandler carries the one
+# formatter (prepare() bakes it into the record); the listener's
+# StreamHandler stays bare so records aren't formatted a second time.
+_log_queue = queue.SimpleQueue()
+_log_handler = QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
 
 # Ensure Telegram Bot Token is provided
 if not TELEGRAM_BOT_TOKEN:
@@ -45,11 +111,57 @@ if not TELEGRAM_BOT_TOKEN:
 # Define UTC timezone
 utc = pytz.UTC
 
+# Initialize Firebase Admin SDK once at import; a second initialize_app raises
+if FIREBASE_CREDENTIALS_PATH and not firebase_admin._apps:
+    firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS_PATH))
+elif not FIREBASE_CREDENTIALS_PATH:
+    logging.warning("FIREBASE_CREDENTIALS_PATH not set; push notifications disabled.")
+
+# FCM caps multicast messages at 500 tokens
+FCM_BATCH_SIZE = 500
+
+# Token bucket for outbound FCM calls so bursts never trip provider 429s;
+# rate and period are operator-tunable via FCM_MAX_RATE / FCM_TIME_PERIOD
+_fcm_limiter = AsyncLimiter(max_rate=FCM_MAX_RATE, time_period=FCM_TIME_PERIOD)
+
+# Precompiled matcher for 0x-prefixed 40-hex-digit wallet addresses;
+# one C-level scan instead of a per-character Python loop
+_WALLET_ADDR_RE = re.compile(r'\A0x[0-9a-fA-F]{40}\Z')
+
+def is_valid_wallet_address(address: str) -> bool:
+    return _WALLET_ADDR_RE.fullmatch(address) is not None
+
+# Static keyboards, built once instead of per /start
+JOIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Join Channel", url="https://t.me/simplco")]
+])
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Launch Mini App", url="t.me/SimplQ_bot/rebltasks")],
+    [InlineKeyboardButton("Invite Friends", callback_data='invite_friends')],
+    [InlineKeyboardButton("Leaderboard", callback_data='leaderboard')],
+    [InlineKeyboardButton("Balance", callback_data='balance')],
+    [InlineKeyboardButton("Daily Rewards", callback_data='daily_rewards')],
+    [InlineKeyboardButton("Wallet", callback_data='wallet')],
+    [InlineKeyboardButton("Ranking", callback_data='ranking')]
+])
+
+# Channel membership cache and a bound on concurrent getChatMember calls;
+# only confirmed memberships are cached so a user who just joined isn't
+# locked out for the TTL
+_channel_cache = TTLCache(maxsize=100_000, ttl=300)
+_chat_member_sem = asyncio.Semaphore(20)
+
 # Helper function: Check if user has joined the required channel
 async def has_joined_channel(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+    if user_id in _channel_cache:
+        return True
     try:
-        member = await context.bot.get_chat_member(chat_id="@simplco", user_id=user_id)
-        return member.status in ['member', 'administrator', 'creator']
+        async with _chat_member_sem:
+            member = await context.bot.get_chat_member(chat_id="@simplco", user_id=user_id)
+        joined = member.status in ['member', 'administrator', 'creator']
+        if joined:
+            _channel_cache[user_id] = True
+        return joined
     except Exception as e:
         logging.warning(f"Error checking channel membership for user {user_id}: {e}")
         return False
@@ -64,44 +176,38 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="Please join @simplco to access all bot features!",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Join Channel", url="https://t.me/simplco")]
-            ])
+            reply_markup=JOIN_MENU
         )
         return
 
-    # Initialize user record if not exists
-    user_record = users_collection.find_one({"user_id": user_id})
-    if not user_record:
-        users_collection.insert_one({
-            "user_id": user_id,
-            "username": username,
-            "balance": 0,
-            "wallet": 0,
-            "rank": None,
-            "joined_channel": True,
-            "last_claimed": None,
-            "tasks_completed": []
-        })
+    # Upsert the user record in a single atomic round-trip; the pre-image is
+    # None exactly when this /start inserted the document
+    previous = await users_collection.find_one_and_update(
+        {"user_id": user_id},
+        {
+            "$setOnInsert": {
+                "username": username,
+                "balance": 0,
+                "wallet": 0,
+                "rank": None,
+                "last_claimed": None,
+                "tasks_completed": []
+            },
+            "$set": {"joined_channel": True}
+        },
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+        projection={"_id": 1}
+    )
+    if previous is None:
         logging.info(f"New user registered: {username} (ID: {user_id})")
-    else:
-        users_collection.update_one({"user_id": user_id}, {"$set": {"joined_channel": True}})
+    invalidate_user(user_id)
 
     # Send main menu
-    reply_markup = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Launch Mini App", url="t.me/SimplQ_bot/rebltasks")],
-        [InlineKeyboardButton("Invite Friends", callback_data='invite_friends')],
-        [InlineKeyboardButton("Leaderboard", callback_data='leaderboard')],
-        [InlineKeyboardButton("Balance", callback_data='balance')],
-        [InlineKeyboardButton("Daily Rewards", callback_data='daily_rewards')],
-        [InlineKeyboardButton("Wallet", callback_data='wallet')],
-        [InlineKeyboardButton("Ranking", callback_data='ranking')]
-    ])
-
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Welcome to the bot! Choose an option:",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU
     )
 
 # Inline Button Handler
@@ -109,16 +215,12 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
 
-    handler_mapping = {
-        'invite_friends': invite_friends,
-        'leaderboard': leaderboard,
-        'balance': balance,
-        'wallet': wallet,
-        'ranking': ranking,
-        'daily_rewards': daily_rewards
-    }
+    # Activity touch doesn't affect the reply; batch it instead of a direct write
+    write_queue.put_nowait(
+        UpdateOne({"user_id": query.from_user.id}, {"$set": {"last_seen": datetime.now(utc)}})
+    )
 
-    handler = handler_mapping.get(query.data)
+    handler = HANDLERS.get(query.data)
     if handler:
         await handler(update, context)
     else:
@@ -126,12 +228,27 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logging.error(f"Unknown callback query: {query.data}")
         await query.message.reply_text(fallback_message)
 
+# Short-TTL read-through cache for user documents: users who rapid-tap
+# through Balance/Wallet hit Mongo once per burst instead of per tap
+_user_cache = TTLCache(maxsize=50_000, ttl=3)
+_USER_PROJECTION = {"_id": 0, "username": 1, "balance": 1, "wallet": 1, "wallet_address": 1, "last_claimed": 1}
+
+async def get_user(user_id: int):
+    if user_id in _user_cache:
+        return _user_cache[user_id]
+    user = await users_collection.find_one({"user_id": user_id}, _USER_PROJECTION)
+    _user_cache[user_id] = user
+    return user
+
+def invalidate_user(user_id: int):
+    _user_cache.pop(user_id, None)
+
 # Balance Handler
 async def balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.callback_query.from_user.id
 
-    # Fetch user data from MongoDB
-    user = users_collection.find_one({"user_id": user_id})
+    # Fetch user data (cached for a few seconds)
+    user = await get_user(user_id)
     if user:
         balance = user.get("balance", 0)
         await update.callback_query.message.reply_text(f"Your current balance is {balance} $REBLCOINS.")
@@ -145,14 +262,29 @@ async def invite_friends(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     referral_link = f"https://t.me/SimplQ_bot?start={referral_id}"
     await update.callback_query.message.reply_text(f"Share this link with your friends: {referral_link}")
 
+# The top-10 board is identical for every caller; cache the rendered text
+# briefly so button-tap bursts don't each trigger a Mongo sort
+_LB_CACHE = {"at": 0.0, "text": ""}
+_LB_TTL = 30  # seconds
+
 # Leaderboard Handler
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # The empty-text check also rejects the initial sentinel entry: monotonic
+    # time can start near 0 (e.g. boot time), making at=0.0 look fresh
+    if _LB_CACHE["text"] and time.monotonic() - _LB_CACHE["at"] < _LB_TTL:
+        await update.callback_query.message.reply_text(_LB_CACHE["text"])
+        return
     try:
-        top_users = users_collection.find().sort("balance", pymongo.DESCENDING).limit(10)
-        leaderboard_text = "🏆 Leaderboard 🏆\n\n"
-        for i, user in enumerate(top_users, 1):
-            username = user.get('username', 'Anonymous')
-            leaderboard_text += f"{i}. {username}: {user.get('balance', 0)} $REBLCOINS\n"
+        top_users = await users_collection.find(
+            {}, {"_id": 0, "username": 1, "balance": 1}
+        ).sort("balance", DESCENDING).limit(10).to_list(10)
+        rows = [
+            f"{i}. {user.get('username', 'Anonymous')}: {user.get('balance', 0)} $REBLCOINS"
+            for i, user in enumerate(top_users, 1)
+        ]
+        leaderboard_text = "🏆 Leaderboard 🏆\n\n" + "\n".join(rows)
+        _LB_CACHE["text"] = leaderboard_text
+        _LB_CACHE["at"] = time.monotonic()
         await update.callback_query.message.reply_text(leaderboard_text)
     except Exception as e:
         logging.error(f"Error retrieving leaderboard: {e}")
@@ -163,28 +295,25 @@ async def daily_rewards(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user_id = update.callback_query.from_user.id
     today = utc.localize(datetime.combine(date.today(), datetime.min.time()))
 
-    user = users_collection.find_one({"user_id": user_id})
-    if not user:
-        await update.callback_query.message.reply_text("No user record found. Please register using /start.")
-        return
-
-    last_claimed = user.get("last_claimed")
-    if last_claimed:
-        last_claimed = utc.localize(last_claimed) if not last_claimed.tzinfo else last_claimed
-        if last_claimed.date() == today.date():
-            await update.callback_query.message.reply_text("You've already claimed your daily reward today.")
-            return
-
-    users_collection.update_one(
-        {"user_id": user_id},
-        {"$set": {"balance": user.get("balance", 0) + 10, "last_claimed": today}}
+    # One conditional write: only matches if the user hasn't claimed today,
+    # so concurrent taps can never double-claim
+    result = await users_collection.update_one(
+        {"user_id": user_id, "$or": [{"last_claimed": None}, {"last_claimed": {"$lt": today}}]},
+        {"$inc": {"balance": 10}, "$set": {"last_claimed": today}}
     )
-    await update.callback_query.message.reply_text("You have successfully claimed 10 $REBLCOINS!")
+
+    if result.modified_count == 1:
+        invalidate_user(user_id)
+        await update.callback_query.message.reply_text("You have successfully claimed 10 $REBLCOINS!")
+    elif await users_collection.find_one({"user_id": user_id}, {"_id": 1}):
+        await update.callback_query.message.reply_text("You've already claimed your daily reward today.")
+    else:
+        await update.callback_query.message.reply_text("No user record found. Please register using /start.")
 
 # Ranking Handler (Optimized for scalability)
 async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.callback_query.from_user.id
-    user_rank = list(users_collection.aggregate([
+    user_rank = await users_collection.aggregate([
         {"$setWindowFields": {
             "partitionBy": None,
             "sortBy": {"balance": -1},
@@ -193,7 +322,7 @@ async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             }
         }},
         {"$match": {"user_id": user_id}}
-    ]))
+    ]).to_list(1)
 
     if user_rank:
         user = user_rank[0]
@@ -207,58 +336,167 @@ async def ranking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.callback_query.from_user.id
 
-    # Fetch user data
-    user = users_collection.find_one({"user_id": user_id})
+    # Fetch user data (cached for a few seconds)
+    user = await get_user(user_id)
     if user:
         wallet = user.get("wallet", 0)
         balance = user.get("balance", 0)
-        await update.callback_query.message.reply_text(f"Your wallet: {wallet}\nYour balance: {balance} $REBLCOINS.")
+        wallet_text = f"Your wallet: {wallet}\nYour balance: {balance} $REBLCOINS."
+        if user.get("wallet_address"):
+            wallet_text += f"\nLinked address: {user['wallet_address']}"
+        await update.callback_query.message.reply_text(wallet_text)
     else:
         await update.callback_query.message.reply_text("No user record found. Please register using /start.")
 
-# Send push notification
-def send_push_notification(token, title, body):
-    """Send a push notification."""
-    # Initialize Firebase Admin SDK
-    cred = credentials.Certificate('/Users/mac/Documents/WORKSPACE/untitled folder/journal/private keys/firebase/rebltasks-d156e-c10cc3a3732e.json')
-    firebase_admin.initialize_app(cred)
-
-    # Create the message
-    message = messaging.Message(
-        notification=messaging.Notification(
-            title=title,
-            body=body
-        ),
-        token=token  # User's device token
-    )
+# Set Wallet Handler
+async def set_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.effective_user.id
+    if not context.args:
+        await update.message.reply_text("Usage: /setwallet <address>")
+        return
 
-    # Send the message
-    response = messaging.send(message)
-    print(f"Push notification sent: {response}")
+    address = context.args[0]
+    if not is_valid_wallet_address(address):
+        await update.message.reply_text("Invalid wallet address. Expected a 0x-prefixed 40-character hex address.")
+        return
+
+    result = await users_collection.update_one({"user_id": user_id}, {"$set": {"wallet_address": address}})
+    if result.matched_count:
+        invalidate_user(user_id)
+        await update.message.reply_text(f"Wallet address linked: {address}")
+    else:
+        await update.message.reply_text("No user record found. Please register using /start.")
+
+# Callback dispatch table, built once after the handlers are defined
+HANDLERS = {
+    'invite_friends': invite_friends,
+    'leaderboard': leaderboard,
+    'balance': balance,
+    'wallet': wallet,
+    'ranking': ranking,
+    'daily_rewards': daily_rewards
+}
 
 # Scheduled Tasks
-def daily_reminder():
-    """Send daily reminders to all users."""
-    users = users_collection.find()
-    for user in users:
-        send_push_notification(user.get("device_token"), "Reminder", "Claim your daily reward!")
+async def daily_reminder():
+    """Send daily reminders to all users via batched FCM multicast."""
+    if not firebase_admin._apps:
+        logging.warning("Firebase not initialized; skipping daily reminder push.")
+        return
+
+    tokens = [t for t in await users_collection.distinct('device_token') if t]
+    if not tokens:
+        return
+
+    sem = asyncio.Semaphore(10)
 
-# Set up scheduler
-scheduler = BackgroundScheduler()
-scheduler.add_job(daily_reminder, 'interval', days=1)
-scheduler.start()
+    async def send_batch(chunk):
+        message = messaging.MulticastMessage(
+            tokens=chunk,
+            notification=messaging.Notification(title="Reminder", body="Claim your daily reward!")
+        )
+        async with sem, _fcm_limiter:
+            # The Firebase SDK is synchronous; keep its HTTPS calls off the loop
+            response = await asyncio.to_thread(messaging.send_each_for_multicast, message)
+        return response.success_count
+
+    chunks = [tokens[i:i + FCM_BATCH_SIZE] for i in range(0, len(tokens), FCM_BATCH_SIZE)]
+    results = await asyncio.gather(*(send_batch(chunk) for chunk in chunks))
+    logging.info(f"Daily reminder sent to {sum(results)}/{len(tokens)} devices")
+
+# Set up scheduler; jobs run directly on the bot's event loop
+scheduler = AsyncIOScheduler()
+
+# Startup work that needs the event loop running: DB connection and scheduler.
+# Called explicitly from main(); Application.initialize() does not run
+# post_init callbacks (only run_polling/run_webhook do).
+async def startup():
+    await init_db()
+    scheduler.add_job(daily_reminder, 'interval', days=1)
+    scheduler.start()
+
+# Webhook route: Telegram pushes updates here; enqueue them for the bot
+async def webhook(request):
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    application = request.app['application']
+    update = Update.de_json(await request.json(), application.bot)
+    await application.update_queue.put(update)
+    return web.Response()
+
+def create_web_app(application):
+    app = web.Application()
+    app['application'] = application
+    app['session'] = http_session
+    app.router.add_post('/webhook', webhook)
+    return app
 
 # Telegram Bot Setup
-def main():
+async def main():
+    global http_session
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300)
+    )
+
     # Telegram Bot application setup
     application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
-    
+
     # Add handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("setwallet", set_wallet))
     application.add_handler(CallbackQueryHandler(button))
-    
-    # Start the bot
-    application.run_polling()
+
+    # Stop on SIGTERM/SIGINT so Cloud Run style shutdowns drain cleanly
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    await startup()
+    await application.start()
+    runner = None
+    try:
+        # The TaskGroup supervises everything sharing the loop; cancelling it
+        # (or the stop event firing) tears the whole group down together.
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(drain_writes(stop))
+            # Webhook mode when a public URL is configured, polling otherwise;
+            # the aiohttp server shares the event loop with the bot and Motor.
+            if WEBHOOK_URL:
+                await application.bot.set_webhook(
+                    url=f"{WEBHOOK_URL.rstrip('/')}/webhook",
+                    allowed_updates=Update.ALL_TYPES,
+                    secret_token=WEBHOOK_SECRET
+                )
+                runner = web.AppRunner(create_web_app(application))
+                await runner.setup()
+                site = web.TCPSite(runner, "0.0.0.0", PORT)
+                await site.start()
+                logging.info(f"Webhook server listening on port {PORT}")
+            else:
+                logging.warning("WEBHOOK_URL not set; falling back to long polling.")
+                await application.updater.start_polling()
+            tg.create_task(stop.wait())
+    finally:
+        if runner:
+            await runner.cleanup()
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        # In polling mode the updater must stop first or Updater.shutdown()
+        # raises and the remaining cleanup is skipped
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await http_session.close()
+        if client:
+            client.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logging.warning("uvloop not installed; using the default asyncio event loop.")
+    asyncio.run(main())